@@ -1,10 +1,21 @@
 import os
 import json
-import time
-from flask import Flask, request, jsonify
+import asyncio
+import io
+import shutil
+import tempfile
+import textwrap
+from pathlib import Path
+from fastapi import FastAPI, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 import typing_extensions as typing
 
+# Production launch (see Procfile):
+#   gunicorn -w 2 -k uvicorn_worker.UvicornWorker -b 0.0.0.0:$PORT video_api:app
+
 # ======================= CONFIGURATION =======================
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -29,12 +40,21 @@ if not API_KEYS:
     print("⚠️ No Environment Variables found. Using hardcoded backup.")
     API_KEYS = ["PASTE_YOUR_BACKUP_KEY_HERE"] 
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# After a quota hit, race this many keys in parallel per attempt
+FAN_OUT_KEYS = 3
+
+app = FastAPI(title="Parkinson's Video Analysis API")
 
 current_key_index = 0
 genai.configure(api_key=API_KEYS[0])
 
+# One long-lived async client (and connection) per key, shared across requests.
+# Created lazily so the gRPC channel binds to the server's running event loop.
+_CLIENTS = {}
+
+# Reuse GenerativeModel objects per (key index, model name)
+_MODEL_CACHE = {}
+
 class ParkinsonAnalysis(typing.TypedDict):
     parkinson_probability: int
     freezing_percentage: float
@@ -45,60 +65,141 @@ class ParkinsonAnalysis(typing.TypedDict):
     clinical_interpretation: str
     recommendation: str
 
-def switch_key():
+# Analysis prompt (built once at import)
+PROMPT: str = textwrap.dedent("""
+    You are an expert Neurologist. Analyze gait for Parkinson's.
+    Evaluate: Arm Swing, Stride Length, Turning Hesitation.
+    Return JSON: parkinson_probability (int), freezing_percentage (float), 
+    bradykinesia_score (0-3), freezing_score (0-3), variability_score (0-3), 
+    reasoning (str), clinical_interpretation (str), recommendation (str).
+""")
+
+def _get_client(key_index):
+    client = _CLIENTS.get(key_index)
+    if client is None:
+        client = glm.GenerativeServiceAsyncClient(client_options={"api_key": API_KEYS[key_index]})
+        _CLIENTS[key_index] = client
+    return client
+
+def _get_model(key_index, model_name):
+    cache_key = (key_index, model_name)
+    model = _MODEL_CACHE.get(cache_key)
+    if model is None:
+        model = genai.GenerativeModel(model_name=model_name)
+        # Bind to this key's client. GenerativeModel has no public client argument;
+        # google-generativeai 0.8.x (pinned in requirements.txt) creates
+        # `_async_client` as None and only fills it lazily when it is still None.
+        # Fail loudly if that changes, instead of silently using the default key.
+        if not hasattr(model, "_async_client"):
+            raise RuntimeError("google-generativeai changed: GenerativeModel._async_client is gone")
+        model._async_client = _get_client(key_index)
+        _MODEL_CACHE[cache_key] = model
+    return model
+
+def set_key(key_index):
     global current_key_index
-    current_key_index = (current_key_index + 1) % len(API_KEYS)
-    new_key = API_KEYS[current_key_index]
-    genai.configure(api_key=new_key)
+    if key_index != current_key_index:
+        current_key_index = key_index
+        # Cached models keep their own client; this only re-points file uploads
+        genai.configure(api_key=API_KEYS[key_index])
+
+def switch_key(steps=1):
+    set_key((current_key_index + steps) % len(API_KEYS))
     print(f"🔑 Limit hit. Switched to Key #{current_key_index + 1}")
 
-def analyze_video_logic(video_path):
+async def _generate(key_index, model_name, video_file):
+    model = _get_model(key_index, model_name)
+    result = await model.generate_content_async(
+        [video_file, PROMPT],
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json", 
+            response_schema=ParkinsonAnalysis,
+            temperature=0.0 
+        ),
+    )
+    return json.loads(result.text)
+
+def _is_quota_error(error_msg):
+    return "429" in error_msg or "Quota" in error_msg or "503" in error_msg
+
+def _is_not_found_error(error_msg):
+    return "404" in error_msg or "not found" in error_msg.lower()
+
+async def _first_success(key_indices, model_name, video_file):
+    # Run the same request on several keys at once; keep the first that succeeds
+    tasks = {asyncio.create_task(_generate(k, model_name, video_file)): k for k in key_indices}
+    pending = set(tasks)
+    errors = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                # Read every exception, even after a success, so none go unretrieved
+                error = task.exception()
+                if error is not None:
+                    errors.append(error)
+                elif winner is None:
+                    winner = task
+            if winner is not None:
+                return tasks[winner], winner.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    # All keys failed: report a retryable error if any key hit one, so the
+    # outcome does not depend on which task happened to finish last
+    for is_retryable in (_is_quota_error, _is_not_found_error):
+        for error in errors:
+            if is_retryable(str(error)):
+                raise error
+    raise errors[-1]
+
+async def analyze_video_logic(video):
+    # `video` is a path or a file-like object (google-generativeai >= 0.8.3)
     global current_model_index
-    print(f"🎬 Processing: {video_path}")
+    print(f"🎬 Processing: {getattr(video, 'name', video)}")
     
-    # 1. Upload
+    # 1. Upload (the Files API is sync-only, so it runs in the thread pool)
     try:
         print("🚀 Uploading to Gemini...")
         # Force MP4 Mime Type
-        video_file = genai.upload_file(path=video_path, mime_type="video/mp4")
+        video_file = await run_in_threadpool(genai.upload_file, path=video, mime_type="video/mp4")
     except Exception as e:
         return {"error": f"Upload failed: {str(e)}"}
 
     # 2. Wait
     print("⏳ Waiting for processing...")
+    delay = 0.25 # Exponential backoff: short clips finish fast
     while video_file.state.name == "PROCESSING":
-        time.sleep(1) # Faster check for 2.5 model
-        video_file = genai.get_file(video_file.name)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 2.0)
+        video_file = await run_in_threadpool(genai.get_file, video_file.name)
     
     if video_file.state.name == "FAILED":
         return {"error": "Video processing failed on Google servers."}
 
     # 3. Analyze Loop
-    prompt = """
-    You are an expert Neurologist. Analyze gait for Parkinson's.
-    Evaluate: Arm Swing, Stride Length, Turning Hesitation.
-    Return JSON: parkinson_probability (int), freezing_percentage (float), 
-    bradykinesia_score (0-3), freezing_score (0-3), variability_score (0-3), 
-    reasoning (str), clinical_interpretation (str), recommendation (str).
-    """
+    # First attempt uses one key; after a quota hit, several keys race in parallel
+    keys_per_attempt = 1
+    keys_tried = 0
     
-    # Try up to 20 times (Keys * Models)
-    for attempt in range(20): 
+    # Send at most 20 generate requests in total (Keys * Models); a parallel
+    # attempt counts once per key, since losing requests still run server-side
+    requests_left = 20
+    attempt = 0
+    while requests_left > 0: 
         try:
             target_model = MODELS[current_model_index]
-            print(f"🤖 Attempt {attempt+1}: Using {target_model}")
+            key_count = min(keys_per_attempt, len(API_KEYS), requests_left)
+            key_indices = [(current_key_index + i) % len(API_KEYS) for i in range(key_count)]
+            requests_left -= key_count
+            attempt += 1
+            print(f"🤖 Attempt {attempt}: Using {target_model} (keys {[k + 1 for k in key_indices]})")
             
-            model = genai.GenerativeModel(model_name=target_model)
-            result = model.generate_content(
-                [video_file, prompt],
-                generation_config=genai.GenerationConfig(
-                    response_mime_type="application/json", 
-                    response_schema=ParkinsonAnalysis,
-                    temperature=0.0 
-                ),
-            )
-            data = json.loads(result.text)
-            genai.delete_file(video_file.name)
+            key_index, data = await _first_success(key_indices, target_model, video_file)
+            set_key(key_index) # Stay on the key that worked
+            await run_in_threadpool(genai.delete_file, video_file.name)
             return data
 
         except Exception as e:
@@ -106,16 +207,19 @@ def analyze_video_logic(video_path):
             print(f"⚠️ Error: {error_msg}")
             
             # CASE 1: LIMIT HIT -> Switch Key
-            if "429" in error_msg or "Quota" in error_msg or "503" in error_msg:
-                switch_key()
+            if _is_quota_error(error_msg):
+                switch_key(len(key_indices))
+                keys_per_attempt = FAN_OUT_KEYS
                 # If cycled all keys, switch MODEL
-                if attempt % len(API_KEYS) == (len(API_KEYS) - 1):
+                keys_tried += len(key_indices)
+                if keys_tried >= len(API_KEYS):
+                    keys_tried = 0
                     current_model_index = (current_model_index + 1) % len(MODELS)
                     print(f"🔄 Switching Model to: {MODELS[current_model_index]}")
-                time.sleep(1)
+                await asyncio.sleep(1)
 
             # CASE 2: MODEL NOT FOUND -> Switch Model Immediately
-            elif "404" in error_msg or "not found" in error_msg.lower():
+            elif _is_not_found_error(error_msg):
                 print(f"❌ Model {target_model} not found. Switching...")
                 current_model_index = (current_model_index + 1) % len(MODELS)
             
@@ -127,49 +231,59 @@ def analyze_video_logic(video_path):
 # =======================================================
 # 👇 ROUTES
 # =======================================================
-@app.route('/', methods=['GET', 'POST'])
-def upload_file():
-    # 1. Health Check
-    if request.method == 'GET':
-        return jsonify({
-            "status": "Live", 
-            "service": "Parkinson Video API (Gemini 2.5)",
-            "endpoints": ["/models"],
-            "message": "Send a POST request with a 'file' to analyze."
-        }), 200
-
-    # 2. Upload Logic
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
+# 1. Health Check
+@app.get('/')
+async def health_check():
+    return {
+        "status": "Live", 
+        "service": "Parkinson Video API (Gemini 2.5)",
+        "endpoints": ["/models"],
+        "message": "Send a POST request with a 'file' to analyze."
+    }
+
+# 2. Upload Logic
+@app.post('/')
+async def upload_file(file: UploadFile = File(None)):
+    if file is None:
+        return JSONResponse(content={"error": "No file part"}, status_code=400)
     
-    file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return JSONResponse(content={"error": "No selected file"}, status_code=400)
     
-    if file:
-        filename = file.filename
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        result = analyze_video_logic(filepath)
+    # Starlette has already spooled the upload to its own temp file. On Python
+    # 3.11+ that is an io.IOBase, which the SDK uploads directly (no second copy).
+    if isinstance(file.file, io.IOBase):
+        await run_in_threadpool(file.file.seek, 0)
+        return await analyze_video_logic(file.file)
+
+    # Older Pythons: the SDK would treat the spooled file as a path, so copy it
+    # to disk once in 1 MiB chunks
+    def save_upload():
+        with tempfile.NamedTemporaryFile(suffix='.mp4', dir=UPLOAD_FOLDER, delete=False) as out:
+            shutil.copyfileobj(file.file, out, length=1 << 20)
+            return out.name
+
+    filepath = await run_in_threadpool(save_upload)
+    
+    try:
+        result = await analyze_video_logic(filepath)
+    finally:
+        # Cleanup errors must not replace a finished analysis
+        try:
+            Path(filepath).unlink(missing_ok=True)
+        except OSError as e:
+            print(f"⚠️ Could not remove {filepath}: {e}")
         
-        if os.path.exists(filepath):
-            try: os.remove(filepath)
-            except: pass
-            
-        return jsonify(result)
+    return result
 
 # ✅ DEBUG ROUTE
-@app.route('/models', methods=['GET'])
-def list_models():
+@app.get('/models')
+async def list_models():
+    def supported_models():
+        return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
     try:
-        model_list = []
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                model_list.append(m.name)
-        return jsonify({"available_models": model_list})
+        model_list = await run_in_threadpool(supported_models)
+        return {"available_models": model_list}
     except Exception as e:
-        return jsonify({"error": str(e)})
-
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+        return {"error": str(e)}